@@ -1,16 +1,44 @@
+import asyncio
 import datetime
 import logging.config
 from environs import Env
 from seller import download_stock
 
-import requests
+import aiohttp
+import orjson
 
-from seller import divide, price_conversion
+from seller import (
+    MAX_UPDATE_REQUESTS,
+    create_session,
+    divide,
+    leaf_errors,
+    prices_conversion,
+    stocks_conversion,
+)
 
 logger = logging.getLogger(__file__)
 
+_MARKET_BASE = "https://api.partner.market.yandex.ru"
 
-def get_product_list(page, campaign_id, access_token):
+
+def _market_headers(access_token):
+    """Формирует заголовки запросов к API Яндекс.Маркета.
+
+    Args:
+        access_token (str): Токен доступа к API Яндекс.Маркета
+
+    Returns:
+        dict: Заголовки с токеном авторизации
+    """
+    return {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {access_token}",
+        "Accept": "application/json",
+        "Host": "api.partner.market.yandex.ru",
+    }
+
+
+async def get_product_list(page, campaign_id, session):
     """Получает список товаров для модели распространения на Яндекс.Маркете.
     
     Выполняет запрос к API Маркета для получения товаров с пагинацией.
@@ -18,33 +46,26 @@ def get_product_list(page, campaign_id, access_token):
     Args:
         page (str): Токен пагинации для получения следующей страницы
         campaign_id (str): Идентификатор модели распространения
-        access_token (str): Токен доступа к API Яндекс.Маркета
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
 
     Returns:
         dict: Словарь с результатами запроса, содержащий товары и информацию о пагинации
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {
         "page_token": page,
         "limit": 200,
     }
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-mapping-entries"
-    response = requests.get(url, headers=headers, params=payload)
-    response.raise_for_status()
-    response_object = response.json()
+    url = f"/campaigns/{campaign_id}/offer-mapping-entries"
+    async with session.get(url, params=payload) as response:
+        response.raise_for_status()
+        response_object = orjson.loads(await response.read())
     return response_object.get("result")
 
 
-def update_stocks(stocks, campaign_id, access_token):
+async def update_stocks(stocks, campaign_id, session, update_limit):
     """Обновляет информацию об остатках товаров на складе.
     
     Отправляет данные об остатках через API Яндекс.Маркета.
@@ -52,30 +73,26 @@ def update_stocks(stocks, campaign_id, access_token):
     Args:
         stocks (list): Список словарей с данными об остатках
         campaign_id (str): Идентификатор модели распространения
-        access_token (str): Токен доступа к API Яндекс.Маркета
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         dict: Ответ API после обновления остатков
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"skus": stocks}
-    url = endpoint_url + f"campaigns/{campaign_id}/offers/stocks"
-    response = requests.put(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
+    url = f"/campaigns/{campaign_id}/offers/stocks"
+    async with update_limit:
+        async with session.put(url, data=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            response_object = orjson.loads(await response.read())
     return response_object
 
 
-def update_price(prices, campaign_id, access_token):
+async def update_price(prices, campaign_id, session, update_limit):
     """Обновляет цены товаров для конкретной модели распространения.
     
     Отправляет новые цены через API Яндекс.Маркета.
@@ -83,55 +100,55 @@ def update_price(prices, campaign_id, access_token):
     Args:
         prices (list): Список словарей с новыми ценами
         campaign_id (str): Идентификатор модели распространения
-        access_token (str): Токен доступа к API Яндекс.Маркета
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         dict: Ответ API после обновления цен
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    endpoint_url = "https://api.partner.market.yandex.ru/"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json",
-        "Host": "api.partner.market.yandex.ru",
-    }
     payload = {"offers": prices}
-    url = endpoint_url + f"campaigns/{campaign_id}/offer-prices/updates"
-    response = requests.post(url, headers=headers, json=payload)
-    response.raise_for_status()
-    response_object = response.json()
+    url = f"/campaigns/{campaign_id}/offer-prices/updates"
+    async with update_limit:
+        async with session.post(url, data=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            response_object = orjson.loads(await response.read())
     return response_object
 
 
-def get_offer_ids(campaign_id, market_token):
+async def get_offer_ids(campaign_id, session):
     """Получает артикулы всех товаров модели распространения на Маркете.
     
     Собирает полный список товаров, обрабатывая все страницы результатов.
+    Следующая страница запрашивается сразу после получения токена пагинации,
+    параллельно с разбором текущей.
 
     Args:
         campaign_id (str): Идентификатор модели распространения
-        market_token (str): Токен доступа к API Яндекс.Маркета
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
 
     Returns:
         list: Список артикулов товаров (shopSku)
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    page = ""
-    product_list = []
-    while True:
-        some_prod = get_product_list(page, campaign_id, market_token)
-        product_list.extend(some_prod.get("offerMappingEntries"))
-        page = some_prod.get("paging").get("nextPageToken")
-        if not page:
-            break
     offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer").get("shopSku"))
+    next_page = asyncio.create_task(get_product_list("", campaign_id, session))
+    while next_page:
+        some_prod = await next_page
+        page = some_prod.get("paging").get("nextPageToken")
+        # Запросим следующую страницу до разбора текущей
+        next_page = None
+        if page:
+            next_page = asyncio.create_task(
+                get_product_list(page, campaign_id, session)
+            )
+        for product in some_prod.get("offerMappingEntries"):
+            offer_ids.append(product.get("offer").get("shopSku"))
     return offer_ids
 
 
@@ -143,55 +160,45 @@ def create_stocks(watch_remnants, offer_ids, warehouse_id):
     2. Для товаров, отсутствующих у поставщика (остаток = 0)
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
         offer_ids (list): Список артикулов товаров на Маркете
         warehouse_id (int): Идентификатор склада в системе Маркета
 
-    Returns:
-        list: Список словарей в формате API Маркета
+    Yields:
+        dict: Запись об остатке в формате API Маркета
     """
     # Уберем то, что не загружено в market
-    stocks = list()
-    date = str(datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z")
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append(
-                {
-                    "sku": str(watch.get("Код")),
-                    "warehouseId": warehouse_id,
-                    "items": [
-                        {
-                            "count": stock,
-                            "type": "FIT",
-                            "updatedAt": date,
-                        }
-                    ],
-                }
-            )
-            offer_ids.remove(str(watch.get("Код")))
+    offer_ids_set = set(offer_ids)
+    date = (
+        datetime.datetime.now(datetime.timezone.utc)
+        .replace(microsecond=0)
+        .isoformat()
+        .replace("+00:00", "Z")
+    )
+    codes = watch_remnants["Код"].astype(str)
+    present = codes.isin(offer_ids_set) & ~codes.duplicated()
+    present_codes = codes[present]
+    item_template = {
+        "count": 0,
+        "type": "FIT",
+        "updatedAt": date,
+    }
+    for sku, stock in zip(
+        present_codes,
+        stocks_conversion(watch_remnants.loc[present, "Количество"]),
+    ):
+        yield {
+            "sku": sku,
+            "warehouseId": warehouse_id,
+            "items": [{**item_template, "count": stock}],
+        }
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append(
-            {
-                "sku": offer_id,
-                "warehouseId": warehouse_id,
-                "items": [
-                    {
-                        "count": 0,
-                        "type": "FIT",
-                        "updatedAt": date,
-                    }
-                ],
-            }
-        )
-    return stocks
+    for offer_id in offer_ids_set.difference(present_codes):
+        yield {
+            "sku": offer_id,
+            "warehouseId": warehouse_id,
+            "items": [item_template.copy()],
+        }
 
 
 def create_prices(watch_remnants, offer_ids):
@@ -200,81 +207,180 @@ def create_prices(watch_remnants, offer_ids):
     Создает записи только для товаров, присутствующих у поставщика.
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
         offer_ids (list): Список артикулов товаров на Маркете
 
     Returns:
         list: Список словарей в формате API Маркета
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "id": str(watch.get("Код")),
-                # "feed": {"id": 0},
-                "price": {
-                    "value": int(price_conversion(watch.get("Цена"))),
-                    # "discountBase": 0,
-                    "currencyId": "RUR",
-                    # "vat": 0,
-                },
-                # "marketSku": 0,
-                # "shopSku": "string",
-            }
-            prices.append(price)
+    offer_ids_set = set(offer_ids)
+    codes = watch_remnants["Код"].astype(str)
+    present = codes.isin(offer_ids_set)
+    prices = [
+        {
+            "id": offer_id,
+            # "feed": {"id": 0},
+            "price": {
+                "value": price,
+                # "discountBase": 0,
+                "currencyId": "RUR",
+                # "vat": 0,
+            },
+            # "marketSku": 0,
+            # "shopSku": "string",
+        }
+        for offer_id, price in zip(
+            codes[present],
+            prices_conversion(watch_remnants.loc[present, "Цена"]).astype(int),
+        )
+    ]
     return prices
 
 
-async def upload_prices(watch_remnants, campaign_id, market_token):
+async def upload_prices(
+    watch_remnants, offer_ids, campaign_id, session, update_limit
+):
     """Асинхронно обновляет цены товаров на Яндекс.Маркете.
     
     Выполняет:
-    1. Получение списка артикулов
-    2. Создание данных для обновления цен
-    3. Пакетную отправку данных (пакеты по 500 товаров)
+    1. Создание данных для обновления цен
+    2. Пакетную отправку данных (пакеты по 500 товаров)
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        offer_ids (list): Список артикулов товаров на Маркете
         campaign_id (str): Идентификатор модели распространения
-        market_token (str): Токен доступа к API Яндекс.Маркета
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         list: Список обновленных цен
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_prices in list(divide(prices, 500)):
-        update_price(some_prices, campaign_id, market_token)
+    async with asyncio.TaskGroup() as task_group:
+        for some_prices in divide(prices, 500):
+            task_group.create_task(
+                update_price(some_prices, campaign_id, session, update_limit)
+            )
     return prices
 
 
-async def upload_stocks(watch_remnants, campaign_id, market_token, warehouse_id):
+async def upload_stocks(
+    watch_remnants, offer_ids, campaign_id, warehouse_id, session, update_limit
+):
     """Асинхронно обновляет остатки товаров на Яндекс.Маркете.
     
     Выполняет:
-    1. Получение списка артикулов
-    2. Создание данных об остатках
-    3. Пакетную отправку данных (пакеты по 2000 товаров)
+    1. Создание данных об остатках
+    2. Отправку каждого пакета сразу после формирования (по 2000 товаров)
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        offer_ids (list): Список артикулов товаров на Маркете
         campaign_id (str): Идентификатор модели распространения
-        market_token (str): Токен доступа к API Яндекс.Маркета
         warehouse_id (int): Идентификатор склада
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
-        tuple: Кортеж из двух списков:
-            - Товары с ненулевым остатком
-            - Все обработанные товары
+        int: Количество товаров с ненулевым остатком
     """
-    offer_ids = get_offer_ids(campaign_id, market_token)
-    stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
-    for some_stock in list(divide(stocks, 2000)):
-        update_stocks(some_stock, campaign_id, market_token)
-    not_empty = list(
-        filter(lambda stock: (stock.get("items")[0].get("count") != 0), stocks)
-    )
-    return not_empty, stocks
+    not_empty = 0
+    some_stocks = create_stocks(watch_remnants, offer_ids, warehouse_id)
+    async with asyncio.TaskGroup() as task_group:
+        for some_stock in divide(some_stocks, 2000):
+            task_group.create_task(
+                update_stocks(some_stock, campaign_id, session, update_limit)
+            )
+            not_empty += sum(
+                1 for stock in some_stock if stock["items"][0]["count"] != 0
+            )
+            # Дадим отправке пакета начаться, пока собирается следующий
+            await asyncio.sleep(0)
+    return not_empty
+
+
+async def process_campaign(
+    watch_remnants, campaign_id, warehouse_id, session, update_limit
+):
+    """Обновляет остатки и цены одной модели распространения на Маркете.
+    
+    Артикулы загружаются один раз, после чего остатки и цены
+    отправляются одновременно.
+
+    Args:
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        campaign_id (str): Идентификатор модели распространения
+        warehouse_id (int): Идентификатор склада
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Маркета
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
+    """
+    offer_ids = await get_offer_ids(campaign_id, session)
+    async with asyncio.TaskGroup() as task_group:
+        task_group.create_task(
+            upload_stocks(
+                watch_remnants,
+                offer_ids,
+                campaign_id,
+                warehouse_id,
+                session,
+                update_limit,
+            )
+        )
+        task_group.create_task(
+            upload_prices(
+                watch_remnants, offer_ids, campaign_id, session, update_limit
+            )
+        )
+
+
+async def update_campaigns(
+    watch_remnants,
+    market_token,
+    campaign_fbs_id,
+    campaign_dbs_id,
+    warehouse_fbs_id,
+    warehouse_dbs_id,
+):
+    """Обновляет остатки и цены моделей FBS и DBS на Яндекс.Маркете.
+
+    Args:
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        market_token (str): Токен доступа к API Яндекс.Маркета
+        campaign_fbs_id (str): Идентификатор модели FBS
+        campaign_dbs_id (str): Идентификатор модели DBS
+        warehouse_fbs_id (int): Идентификатор склада для FBS
+        warehouse_dbs_id (int): Идентификатор склада для DBS
+    """
+    async with create_session(
+        base_url=_MARKET_BASE, headers=_market_headers(market_token)
+    ) as session:
+        update_limit = asyncio.Semaphore(MAX_UPDATE_REQUESTS)
+        # Ошибка в одной модели отменяет обновление другой до закрытия сессии
+        async with asyncio.TaskGroup() as task_group:
+            # FBS
+            task_group.create_task(
+                process_campaign(
+                    watch_remnants,
+                    campaign_fbs_id,
+                    warehouse_fbs_id,
+                    session,
+                    update_limit,
+                )
+            )
+            # DBS
+            task_group.create_task(
+                process_campaign(
+                    watch_remnants,
+                    campaign_dbs_id,
+                    warehouse_dbs_id,
+                    session,
+                    update_limit,
+                )
+            )
 
 
 def main():
@@ -287,29 +393,24 @@ def main():
 
     watch_remnants = download_stock()
     try:
-        # FBS
-        offer_ids = get_offer_ids(campaign_fbs_id, market_token)
-        # Обновить остатки FBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_fbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_fbs_id, market_token)
-        # Поменять цены FBS
-        upload_prices(watch_remnants, campaign_fbs_id, market_token)
-
-        # DBS
-        offer_ids = get_offer_ids(campaign_dbs_id, market_token)
-        # Обновить остатки DBS
-        stocks = create_stocks(watch_remnants, offer_ids, warehouse_dbs_id)
-        for some_stock in list(divide(stocks, 2000)):
-            update_stocks(some_stock, campaign_dbs_id, market_token)
-        # Поменять цены DBS
-        upload_prices(watch_remnants, campaign_dbs_id, market_token)
-    except requests.exceptions.ReadTimeout:
+        asyncio.run(
+            update_campaigns(
+                watch_remnants,
+                market_token,
+                campaign_fbs_id,
+                campaign_dbs_id,
+                warehouse_fbs_id,
+                warehouse_dbs_id,
+            )
+        )
+    except* asyncio.TimeoutError:
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
-        print(error, "Ошибка соединения")
-    except Exception as error:
-        print(error, "ERROR_2")
+    except* aiohttp.ClientConnectionError as errors:
+        for error in leaf_errors(errors):
+            print(error, "Ошибка соединения")
+    except* Exception as errors:
+        for error in leaf_errors(errors):
+            print(error, "ERROR_2")
 
 
 if __name__ == "__main__":
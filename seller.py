@@ -1,37 +1,77 @@
+import asyncio
 import io
 import logging.config
-import os
 import re
 import zipfile
+from collections.abc import Iterable
 from environs import Env
+from itertools import islice
 
+import aiohttp
+import orjson
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__file__)
 
+# Ограничение числа одновременных запросов на обновление товаров
+MAX_UPDATE_REQUESTS = 5
 
-def get_product_list(last_id, client_id, seller_token):
+_OZON_BASE = "https://api-seller.ozon.ru"
+
+_NON_DIGITS = re.compile(r"[^0-9]")
+
+_SESSION = requests.Session()
+_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=20,
+        max_retries=Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False,
+        ),
+    ),
+)
+
+
+def _ozon_headers(client_id, seller_token):
+    """Формирует заголовки запросов к API Ozon.
+
+    Args:
+        client_id (str): Идентификатор приложения для работы с API Ozon
+        seller_token (str): API-ключ продавца
+
+    Returns:
+        dict: Заголовки с данными авторизации
+    """
+    return {
+        "Client-Id": client_id,
+        "Api-Key": seller_token,
+        "Content-Type": "application/json",
+    }
+
+
+async def get_product_list(last_id, session):
     """Получает список товаров магазина на Ozon.
     
     Делает запрос к API Ozon для получения информации о товарах с пагинацией.
 
     Args:
         last_id (str): Идентификатор последнего товара
-        client_id (str): Идентификатор приложения для работы с API Ozon
-        seller_token (str): API-ключ продавца
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
 
     Returns:
         dict: Словарь с результатами запроса, содержащий информацию о товарах
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    url = "https://api-seller.ozon.ru/v2/product/list"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    url = "/v2/product/list"
     payload = {
         "filter": {
             "visibility": "ALL",
@@ -39,95 +79,91 @@ def get_product_list(last_id, client_id, seller_token):
         "last_id": last_id,
         "limit": 1000,
     }
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    response_object = response.json()
+    async with session.post(url, data=orjson.dumps(payload)) as response:
+        response.raise_for_status()
+        response_object = orjson.loads(await response.read())
     return response_object.get("result")
 
 
-def get_offer_ids(client_id, seller_token):
+async def get_offer_ids(session):
     """Получает артикулы всех товаров магазина на Ozon.
     
     Собирает полный список товаров, обрабатывая все страницы результатов.
 
     Args:
-        client_id (str): Идентификатор приложения для работы с API Ozon
-        seller_token (str): API-ключ продавца
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
 
     Returns:
         list: Список артикулов товаров (offer_id)
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
     
-    last_id = ""
-    product_list = []
+    some_prod = await get_product_list("", session)
+    total = some_prod.get("total")
+    product_list = [None] * total
+    loaded = 0
     while True:
-        some_prod = get_product_list(last_id, client_id, seller_token)
-        product_list.extend(some_prod.get("items"))
-        total = some_prod.get("total")
-        last_id = some_prod.get("last_id")
-        if total == len(product_list):
+        items = some_prod.get("items")
+        product_list[loaded : loaded + len(items)] = items
+        loaded += len(items)
+        if loaded >= total or not items:
             break
-    offer_ids = []
-    for product in product_list:
-        offer_ids.append(product.get("offer_id"))
+        last_id = some_prod.get("last_id")
+        some_prod = await get_product_list(last_id, session)
+    offer_ids = [product.get("offer_id") for product in product_list[:loaded]]
     return offer_ids
 
 
-def update_price(prices: list, client_id, seller_token):
+async def update_price(prices: list, session, update_limit):
     """Обновляет цены товаров на Ozon.
     
     Отправляет новые цены через API Ozon.
 
     Args:
         prices (list): Список словарей с ценами товаров
-        client_id (str): Идентификатор приложения для работы с API Ozon
-        seller_token (str): API-ключ продавца
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         dict: Ответ API Ozon после обновления цен
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/prices"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    url = "/v1/product/import/prices"
     payload = {"prices": prices}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    async with update_limit:
+        async with session.post(url, data=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
 
 
-def update_stocks(stocks: list, client_id, seller_token):
+async def update_stocks(stocks: list, session, update_limit):
     """Обновляет информацию об остатках товаров на Ozon.
     
     Отправляет новые данные о количестве товаров через API Ozon.
 
     Args:
         stocks (list): Список словарей с данными об остатках
-        client_id (str): Идентификатор приложения для работы с API Ozon
-        seller_token (str): API-ключ продавца
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         dict: Ответ API Ozon после обновления остатков
         
     Raises:
-        requests.exceptions.HTTPError: При ошибке HTTP-запроса
+        aiohttp.ClientResponseError: При ошибке HTTP-запроса
     """
-    url = "https://api-seller.ozon.ru/v1/product/import/stocks"
-    headers = {
-        "Client-Id": client_id,
-        "Api-Key": seller_token,
-    }
+    url = "/v1/product/import/stocks"
     payload = {"stocks": stocks}
-    response = requests.post(url, json=payload, headers=headers)
-    response.raise_for_status()
-    return response.json()
+    async with update_limit:
+        async with session.post(url, data=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            return orjson.loads(await response.read())
 
 
 def download_stock():
@@ -135,32 +171,29 @@ def download_stock():
     
     Выполняет:
     1. Скачивание ZIP-архива с остатками с сайта поставщика
-    2. Распаковку архива
-    3. Чтение данных из Excel-файла
-    4. Удаление временного файла
+    2. Чтение данных из Excel-файла прямо из архива, без распаковки на диск
 
     Returns:
-        list: Список словарей с информацией об остатках товаров
+        pandas.DataFrame: Таблица с информацией об остатках товаров
         
     Raises:
         requests.exceptions.HTTPError: При ошибке HTTP-запроса
     """
     # Скачать остатки с сайта
     casio_url = "https://timeworld.ru/upload/files/ostatki.zip"
-    session = requests.Session()
-    response = session.get(casio_url)
+    response = _SESSION.get(casio_url)
     response.raise_for_status()
+    # Создаем список остатков часов, читая файл прямо из архива в памяти:
     with response, zipfile.ZipFile(io.BytesIO(response.content)) as archive:
-        archive.extractall(".")
-    # Создаем список остатков часов:
-    excel_file = "ostatki.xls"
-    watch_remnants = pd.read_excel(
-        io=excel_file,
-        na_values=None,
-        keep_default_na=False,
-        header=17,
-    ).to_dict(orient="records")
-    os.remove("./ostatki.xls")  # Удалить файл
+        with archive.open("ostatki.xls") as excel_file:
+            watch_remnants = pd.read_excel(
+                io=excel_file,
+                na_values=None,
+                keep_default_na=False,
+                header=17,
+                usecols=["Код", "Количество", "Цена"],
+                engine="xlrd",
+            )
     return watch_remnants
 
 
@@ -172,29 +205,25 @@ def create_stocks(watch_remnants, offer_ids):
     2. Для товаров, отсутствующих у поставщика (остаток = 0)
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
         offer_ids (list): Список артикулов товаров на Ozon
 
-    Returns:
-        list: Список словарей в формате, готовом для отправки в API Ozon
+    Yields:
+        dict: Запись об остатке в формате, готовом для отправки в API Ozon
     """
     # Уберем то, что не загружено в seller
-    stocks = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            count = str(watch.get("Количество"))
-            if count == ">10":
-                stock = 100
-            elif count == "1":
-                stock = 0
-            else:
-                stock = int(watch.get("Количество"))
-            stocks.append({"offer_id": str(watch.get("Код")), "stock": stock})
-            offer_ids.remove(str(watch.get("Код")))
+    offer_ids_set = set(offer_ids)
+    codes = watch_remnants["Код"].astype(str)
+    present = codes.isin(offer_ids_set) & ~codes.duplicated()
+    present_codes = codes[present]
+    for offer_id, stock in zip(
+        present_codes,
+        stocks_conversion(watch_remnants.loc[present, "Количество"]),
+    ):
+        yield {"offer_id": offer_id, "stock": stock}
     # Добавим недостающее из загруженного:
-    for offer_id in offer_ids:
-        stocks.append({"offer_id": offer_id, "stock": 0})
-    return stocks
+    for offer_id in offer_ids_set.difference(present_codes):
+        yield {"offer_id": offer_id, "stock": 0}
 
 
 def create_prices(watch_remnants, offer_ids):
@@ -203,23 +232,28 @@ def create_prices(watch_remnants, offer_ids):
     Создает записи только для товаров, присутствующих у поставщика.
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
         offer_ids (list): Список артикулов товаров на Ozon
 
     Returns:
         list: Список словарей с ценами в формате API Ozon
     """
-    prices = []
-    for watch in watch_remnants:
-        if str(watch.get("Код")) in offer_ids:
-            price = {
-                "auto_action_enabled": "UNKNOWN",
-                "currency_code": "RUB",
-                "offer_id": str(watch.get("Код")),
-                "old_price": "0",
-                "price": price_conversion(watch.get("Цена")),
-            }
-            prices.append(price)
+    offer_ids_set = set(offer_ids)
+    codes = watch_remnants["Код"].astype(str)
+    present = codes.isin(offer_ids_set)
+    prices = [
+        {
+            "auto_action_enabled": "UNKNOWN",
+            "currency_code": "RUB",
+            "offer_id": offer_id,
+            "old_price": "0",
+            "price": price,
+        }
+        for offer_id, price in zip(
+            codes[present],
+            prices_conversion(watch_remnants.loc[present, "Цена"]),
+        )
+    ]
     return prices
 
 
@@ -248,75 +282,174 @@ def price_conversion(price: str) -> str:
         при отсутствии цифр в исходных данных. Рекомендуется предварительная
         валидация входных значений.
     """    
-    return re.sub("[^0-9]", "", price.split(".")[0])
+    return _NON_DIGITS.sub("", price.split(".", 1)[0])
+
 
+def prices_conversion(prices: pd.Series) -> pd.Series:
+    """Преобразует столбец с ценами в числовой формат без символов.
+    
+    Векторная версия price_conversion для столбца таблицы остатков.
+
+    Args:
+        prices (pandas.Series): Исходные строки с ценами
+
+    Returns:
+        pandas.Series: Цены в виде строк, содержащих только целые числа
+    """
+    return (
+        prices.astype(str)
+        .str.split(".", n=1)
+        .str[0]
+        .str.replace(_NON_DIGITS, "", regex=True)
+    )
 
-def divide(lst: list, n: int):
-    """Разделяет список на части фиксированного размера.
+
+def stocks_conversion(counts: pd.Series) -> pd.Series:
+    """Преобразует остатки поставщика в количество для маркетплейсов.
     
-    Генератор, который разбивает список на подсписки указанного размера.
+    Остаток ">10" считается равным 100, а остаток "1" - нулевым.
+
+    Пример преобразования:
+        [">10", "1", "5"] -> [100, 0, 5]
+
+    Args:
+        counts (pandas.Series): Остатки из таблицы поставщика
+
+    Returns:
+        pandas.Series: Остатки в виде целых чисел. Нечисловые значения
+            считаются нулевыми.
+    """
+    counts = counts.astype(str)
+    stocks = pd.to_numeric(counts, errors="coerce").fillna(0).astype(int)
+    return stocks.mask(counts == ">10", 100).mask(counts == "1", 0)
+
+
+def divide(lst: Iterable, n: int):
+    """Разделяет последовательность на части фиксированного размера.
+    
+    Генератор, который разбивает список или другой итерируемый объект
+    на подсписки указанного размера. Элементы берутся из источника по мере
+    формирования частей, поэтому генераторы не материализуются целиком.
     
     Пример преобразования:
         list(divide([1, 2, 3, 4, 5], 2)) -> [[1, 2], [3, 4], [5]]
 
     Args:
-        lst (list): Исходный список для разделения
+        lst (Iterable): Исходная последовательность для разделения
         n (int): Максимальный размер каждого подсписка
 
     Yields:
-        list: Очередная часть исходного списка
+        list: Очередная часть исходной последовательности
     """
-    for i in range(0, len(lst), n):
-        yield lst[i : i + n]
+    items = iter(lst)
+    while some_items := list(islice(items, n)):
+        yield some_items
 
 
-async def upload_prices(watch_remnants, client_id, seller_token):
+def create_session(base_url=None, headers=None):
+    """Создает HTTP-сессию для запросов к API маркетплейсов.
+    
+    Одна сессия используется для всех запросов скрипта, чтобы переиспользовать
+    открытые соединения из пула.
+
+    Args:
+        base_url (str, optional): Адрес API, относительно которого указываются
+            пути запросов
+        headers (dict, optional): Заголовки, добавляемые ко всем запросам сессии
+
+    Returns:
+        aiohttp.ClientSession: Новая HTTP-сессия
+    """
+    return aiohttp.ClientSession(
+        base_url=base_url,
+        headers=headers,
+        connector=aiohttp.TCPConnector(limit=20, limit_per_host=10),
+        timeout=aiohttp.ClientTimeout(total=60),
+    )
+
+
+async def upload_prices(watch_remnants, offer_ids, session, update_limit):
     """Асинхронно обновляет цены товаров на Ozon.
     
     Выполняет:
-    1. Получение списка артикулов
-    2. Создание данных для обновления цен
-    3. Пакетную отправку данных в API Ozon
+    1. Создание данных для обновления цен
+    2. Пакетную отправку данных в API Ozon
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
-        client_id (str): Идентификатор клиента Ozon
-        seller_token (str): API-ключ продавца
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        offer_ids (list): Список артикулов товаров на Ozon
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
 
     Returns:
         list: Список обновленных цен
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
     prices = create_prices(watch_remnants, offer_ids)
-    for some_price in list(divide(prices, 1000)):
-        update_price(some_price, client_id, seller_token)
+    async with asyncio.TaskGroup() as task_group:
+        for some_price in divide(prices, 1000):
+            task_group.create_task(update_price(some_price, session, update_limit))
     return prices
 
 
-async def upload_stocks(watch_remnants, client_id, seller_token):
+async def upload_stocks(watch_remnants, offer_ids, session, update_limit):
     """Асинхронно обновляет остатки товаров на Ozon.
     
     Выполняет:
-    1. Получение списка артикулов
-    2. Создание данных об остатках
-    3. Пакетную отправку данных в API Ozon
+    1. Создание данных об остатках
+    2. Отправку каждого пакета в API Ozon сразу после формирования
+
+    Args:
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        offer_ids (list): Список артикулов товаров на Ozon
+        session (aiohttp.ClientSession): HTTP-сессия с заголовками Ozon
+        update_limit (asyncio.Semaphore): Ограничение числа одновременных
+            запросов на обновление товаров
+
+    Returns:
+        int: Количество товаров с ненулевым остатком
+    """
+    not_empty = 0
+    async with asyncio.TaskGroup() as task_group:
+        for some_stock in divide(create_stocks(watch_remnants, offer_ids), 100):
+            task_group.create_task(update_stocks(some_stock, session, update_limit))
+            not_empty += sum(1 for stock in some_stock if stock["stock"] != 0)
+            # Дадим отправке пакета начаться, пока собирается следующий
+            await asyncio.sleep(0)
+    return not_empty
+
+
+async def update_products(watch_remnants, client_id, seller_token):
+    """Обновляет остатки и цены товаров магазина на Ozon.
 
     Args:
-        watch_remnants (list): Данные об остатках от поставщика
-        client_id (str): Идентификатор клиента Ozon
+        watch_remnants (pandas.DataFrame): Данные об остатках от поставщика
+        client_id (str): Идентификатор приложения для работы с API Ozon
         seller_token (str): API-ключ продавца
+    """
+    async with create_session(
+        base_url=_OZON_BASE, headers=_ozon_headers(client_id, seller_token)
+    ) as session:
+        update_limit = asyncio.Semaphore(MAX_UPDATE_REQUESTS)
+        offer_ids = await get_offer_ids(session)
+        # Обновить остатки
+        await upload_stocks(watch_remnants, offer_ids, session, update_limit)
+        # Поменять цены
+        await upload_prices(watch_remnants, offer_ids, session, update_limit)
+
+
+def leaf_errors(error):
+    """Возвращает исключения, вложенные в группы исключений.
+
+    Args:
+        error (BaseException): Исключение или группа исключений
 
     Returns:
-        tuple: Кортеж из двух списков:
-            - Товары с ненулевым остатком
-            - Все обработанные товары
+        list: Исключения без вложенных групп
     """
-    offer_ids = get_offer_ids(client_id, seller_token)
-    stocks = create_stocks(watch_remnants, offer_ids)
-    for some_stock in list(divide(stocks, 100)):
-        update_stocks(some_stock, client_id, seller_token)
-    not_empty = list(filter(lambda stock: (stock.get("stock") != 0), stocks))
-    return not_empty, stocks
+    if isinstance(error, BaseExceptionGroup):
+        return [leaf for sub in error.exceptions for leaf in leaf_errors(sub)]
+    return [error]
 
 
 def main():
@@ -324,22 +457,19 @@ def main():
     seller_token = env.str("SELLER_TOKEN")
     client_id = env.str("CLIENT_ID")
     try:
-        offer_ids = get_offer_ids(client_id, seller_token)
         watch_remnants = download_stock()
-        # Обновить остатки
-        stocks = create_stocks(watch_remnants, offer_ids)
-        for some_stock in list(divide(stocks, 100)):
-            update_stocks(some_stock, client_id, seller_token)
-        # Поменять цены
-        prices = create_prices(watch_remnants, offer_ids)
-        for some_price in list(divide(prices, 900)):
-            update_price(some_price, client_id, seller_token)
-    except requests.exceptions.ReadTimeout:
+        asyncio.run(update_products(watch_remnants, client_id, seller_token))
+    except* (requests.exceptions.ReadTimeout, asyncio.TimeoutError):
         print("Превышено время ожидания...")
-    except requests.exceptions.ConnectionError as error:
-        print(error, "Ошибка соединения")
-    except Exception as error:
-        print(error, "ERROR_2")
+    except* (
+        requests.exceptions.ConnectionError,
+        aiohttp.ClientConnectionError,
+    ) as errors:
+        for error in leaf_errors(errors):
+            print(error, "Ошибка соединения")
+    except* Exception as errors:
+        for error in leaf_errors(errors):
+            print(error, "ERROR_2")
 
 
 if __name__ == "__main__":